@@ -2,18 +2,22 @@
 # A4 Markdown Writer in Python using Streamlit
 # - Portrait or landscape
 # - 1–4 columns with quick presets (2-up, 3-up, 4-up)
-# - Markdown with code highlighting
-# - Math via MathJax ($...$ and $$...$$)
+# - Markdown rendered server-side (markdown-it-py) with code highlighting
+# - Math via KaTeX ($...$ and $$...$$)
 # - Template picker (Lecture Notes, Code Snippets, Formula Sheet, Blank)
 # - Printable to A4 using browser print (Save as PDF)
 #
 # Usage:
-#   pip install streamlit
+#   pip install streamlit markdown-it-py mdit-py-plugins
 #   streamlit run app.py
 
 import streamlit as st
-from streamlit.components.v1 import html as st_html
-import base64
+import gzip
+import time
+
+from components import md_render
+from components.md_editor import md_editor
+from components.md_preview import md_preview
 
 st.set_page_config(page_title="A4 Markdown Writer", layout="wide")
 
@@ -96,6 +100,12 @@ $\sin^2 x + \cos^2 x = 1$
 # Sidebar controls
 # --------------------------
 st.sidebar.title("Page Settings")
+
+# Seed widget state once; the widgets below bind purely via key so a preset
+# or template write never conflicts with a value= argument.
+for _k, _v in {"columns": 2, "margin_mm": 12, "gap_mm": 8, "font_px": 11, "show_guides": True}.items():
+    st.session_state.setdefault(_k, _v)
+
 cols = st.sidebar.columns(3)
 with cols[0]:
     if st.button("2-up"):
@@ -108,12 +118,13 @@ with cols[2]:
         st.session_state.update(PRESETS["4-up"])
 
 orientation = st.sidebar.selectbox("Orientation", ["portrait", "landscape"], index=0, key="orientation")
-columns = st.sidebar.slider("Columns", 1, 4, st.session_state.get("columns", 2), key="columns")
-margin_mm = st.sidebar.slider("Page margin (mm)", 5, 25, st.session_state.get("margin_mm", 12), key="margin_mm")
-gap_mm = st.sidebar.slider("Column gap (mm)", 4, 20, st.session_state.get("gap_mm", 8), key="gap_mm")
-font_px = st.sidebar.slider("Base font (px)", 9, 16, st.session_state.get("font_px", 11), key="font_px")
-show_guides = st.sidebar.checkbox("Show column guides", st.session_state.get("show_guides", True), key="show_guides")
+columns = st.sidebar.slider("Columns", 1, 4, key="columns")
+margin_mm = st.sidebar.slider("Page margin (mm)", 5, 25, key="margin_mm")
+gap_mm = st.sidebar.slider("Column gap (mm)", 4, 20, key="gap_mm")
+font_px = st.sidebar.slider("Base font (px)", 9, 16, key="font_px")
+show_guides = st.sidebar.checkbox("Show column guides", key="show_guides")
 show_print_button = st.sidebar.checkbox("Show Print button", True, key="show_print_button")
+show_perf = st.sidebar.checkbox("Show perf panel", False, key="show_perf")
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("Templates")
@@ -159,95 +170,207 @@ if load_replace:
 elif load_append:
     st.session_state.md += "" + TEMPLATES[selected_template]
 
-md = st.text_area("Markdown", value=st.session_state.md, height=480, key="md")
+# The editor only reports text after 300 ms of quiescence; adopt its value
+# only when it sent something new (by seq, not text: retyping what was there
+# before a template load is still an edit), so a template load sticks.
+edited = md_editor(st.session_state.md, height=480, debounce_ms=300, key="md_editor")
+if edited is not None:
+    sent = (edited["session"], edited["seq"])
+    if sent != st.session_state.get("md_editor_seen"):
+        st.session_state.md_editor_seen = sent
+        st.session_state.md = edited["text"]
+md = st.session_state.md
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def render_segments(md):
+    """Render markdown to one HTML string per segment (math is typeset client-side)."""
+    return md_render.render_segments(md)
+
 
 # --------------------------
-# Build printable HTML using client-side renderers
-# - marked.js to render Markdown
-# - DOMPurify to sanitize
-# - MathJax to typeset LaTeX
+# Build printable HTML around the pre-rendered segments
+# - KaTeX to typeset LaTeX
 # - highlight.js for code
 # --------------------------
-A4_W, A4_H = 210, 297
-page_w = A4_W if orientation == "portrait" else A4_H
-page_h = A4_H if orientation == "portrait" else A4_W
-rule_css = f"column-rule: {'1px solid #ddd' if show_guides else 'none'};"
-
-# Escape for JS template string
-md_js = (
-    md.replace("\\", r"\\\\")
-      .replace("`", r"\`")
-      .replace("$", r"\$")
-)
-
-html_doc = f"""
-<!doctype html>
+# Static halves of the preview document; only the CSS vars block, toolbar
+# label and rendered segments change between reruns.
+_HEAD_HTML = """<!doctype html>
 <html>
 <head>
-  <meta charset=\"utf-8\" />
-  <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
-  <link rel=\"stylesheet\" href=\"https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github.min.css\"/>
-  <script src=\"https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js\"></script>
-  <script src=\"https://cdn.jsdelivr.net/npm/dompurify@3.1.7/dist/purify.min.js\"></script>
-  <script src=\"https://cdn.jsdelivr.net/npm/marked/marked.min.js\"></script>
-  <script>
-    window.MathJax = {{ tex: {{ inlineMath: [['$','$'], ['\\(','\\)']] }}, svg: {{fontCache: 'global'}} }};
+  <meta charset="utf-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1" />
+  <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github.min.css"/>
+  <script type="module">
+    // Core + only the grammars the templates use, instead of the full bundle
+    import hljs from 'https://cdn.jsdelivr.net/npm/@highlightjs/cdn-assets@11.9.0/es/core.min.js';
+    import python from 'https://cdn.jsdelivr.net/npm/@highlightjs/cdn-assets@11.9.0/es/languages/python.min.js';
+    import bash from 'https://cdn.jsdelivr.net/npm/@highlightjs/cdn-assets@11.9.0/es/languages/bash.min.js';
+    import sql from 'https://cdn.jsdelivr.net/npm/@highlightjs/cdn-assets@11.9.0/es/languages/sql.min.js';
+    hljs.registerLanguage('python', python);
+    hljs.registerLanguage('bash', bash);
+    hljs.registerLanguage('sql', sql);
+    window.hljs = hljs;
   </script>
-  <script src=\"https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js\"></script>
+  <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/katex@0.16.11/dist/katex.min.css"/>
+  <script defer src="https://cdn.jsdelivr.net/npm/katex@0.16.11/dist/katex.min.js"></script>
   <style>
-    :root {{
-      --page-w-mm: {page_w}mm;
-      --page-h-mm: {page_h}mm;
-      --margin-mm: {margin_mm}mm;
-      --gap-mm: {gap_mm}mm;
-      --font-px: {font_px}px;
-      --cols: {columns};
-    }}
-    @page {{ size: A4 {orientation}; margin: var(--margin-mm); }}
-    html, body {{ height: 100%; }}
-    body {{ background: #f4f5f7; margin: 0; }}
-    .toolbar {{ position: sticky; top: 0; background: #fff; border-bottom: 1px solid #e5e7eb; padding: 8px 12px; z-index: 10; font-family: system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial; }}
-    .page-shell {{ width: var(--page-w-mm); height: var(--page-h-mm); margin: 24px auto; background: #fff; box-shadow: 0 10px 25px rgba(0,0,0,.08); overflow: hidden; }}
-    .page-content {{ box-sizing: border-box; padding: var(--margin-mm); font-size: var(--font-px); line-height: 1.45; column-count: var(--cols); column-gap: var(--gap-mm); {rule_css} font-family: system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial; }}
-    .page-content h1, .page-content h2, .page-content h3 {{ break-inside: avoid; }}
-    .page-content pre, .page-content code, .page-content img, .page-content table {{ break-inside: avoid; max-width: 100%; }}
-    .page-content pre {{ background: #f6f8fa; padding: 10px; border-radius: 6px; overflow: auto; }}
-    .page-content code {{ font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, monospace; }}
-    @media print {{ body {{ -webkit-print-color-adjust: exact; print-color-adjust: exact; background: #fff; }} .toolbar {{ display: none; }} .page-shell {{ box-shadow: none; margin: 0 auto; }} }}
+    html, body { height: 100%; }
+    body { background: #f4f5f7; margin: 0; }
+    .toolbar { position: sticky; top: 0; background: #fff; border-bottom: 1px solid #e5e7eb; padding: 8px 12px; z-index: 10; font-family: system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial; }
+    .page-shell { width: var(--page-w-mm); height: var(--page-h-mm); margin: 24px auto; background: #fff; box-shadow: 0 10px 25px rgba(0,0,0,.08); overflow: hidden; }
+    .page-content { box-sizing: border-box; padding: var(--margin-mm); font-size: var(--font-px); line-height: 1.45; column-count: var(--cols); column-gap: var(--gap-mm); font-family: system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial; }
+    /* Each segment is a heading plus its body: columns fill top to bottom and never split one */
+    .page-content .col-item { break-inside: avoid; }
+    .page-content h1, .page-content h2, .page-content h3 { break-inside: avoid; }
+    .page-content pre, .page-content code, .page-content img, .page-content table { break-inside: avoid; max-width: 100%; }
+    .page-content pre { background: #f6f8fa; padding: 10px; border-radius: 6px; overflow: auto; }
+    .page-content:empty::before { content: "Rendering…"; color: #9ca3af; }
+    .page-content code { font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, monospace; }
+    @media print { body { -webkit-print-color-adjust: exact; print-color-adjust: exact; background: #fff; } .toolbar { display: none; } .page-shell { box-shadow: none; margin: 0 auto; } }
   </style>
-</head>
-<body>
-  <div class=\"toolbar\">A4 preview • {orientation} • {columns} column(s)</div>
-  <div class=\"page-shell\"><div id=\"content\" class=\"page-content\"></div></div>
+"""
+
+_BODY_OPEN = """
+  <div class="page-shell"><div id="content" class="page-content">"""
+
+_TAIL_HTML = """</div></div>
   <script>
-    const raw = `{md_js}`;
-    const html = DOMPurify.sanitize(marked.parse(raw));
     const container = document.getElementById('content');
-    container.innerHTML = html;
-    document.querySelectorAll('pre code').forEach(el => window.hljs.highlightElement(el));
-    if (window.MathJax && window.MathJax.typeset) {{ window.MathJax.typeset([container]); }}
+
+    // Heavy rendering waits for browser idle time so the page frame paints first
+    const whenIdle = () => new Promise(resolve =>
+      (window.requestIdleCallback || (cb => setTimeout(cb, 1)))(resolve, { timeout: 500 }));
+
+    // Highlight only fenced blocks in a registered language; auto-detection is the slow path
+    function highlightCode(node) {
+      node.querySelectorAll('pre code[class*="language-"]').forEach(el => {
+        const lang = el.className.match(/language-(\\S+)/)[1];
+        if (window.hljs && hljs.getLanguage(lang)) hljs.highlightElement(el);
+      });
+    }
+
+    // Without KaTeX (CDN failed) the math stays as source text
+    function renderMath(node) {
+      if (!window.katex) return;
+      node.querySelectorAll('.math').forEach(el => katex.render(el.textContent, el, {
+        displayMode: el.classList.contains('block'), throwOnError: false,
+      }));
+    }
+
+    // Deferred and module scripts have all run by DOMContentLoaded
+    window.addEventListener('DOMContentLoaded', () => whenIdle().then(() => {
+      highlightCode(container);
+      renderMath(container);
+    }));
   </script>
 </body>
 </html>
 """
 
+
+# Per-document CSS vars block and toolbar; _HOLE marks where values go.
+_HOLE = "\x00"
+_VARS_HTML = f"""  <style>
+    :root {{
+      --page-w-mm: {_HOLE}mm;
+      --page-h-mm: {_HOLE}mm;
+      --margin-mm: {_HOLE}mm;
+      --gap-mm: {_HOLE}mm;
+      --font-px: {_HOLE}px;
+      --cols: {_HOLE};
+    }}
+    @page {{ size: A4 {_HOLE}; margin: var(--margin-mm); }}
+    .page-content {{ {_HOLE} }}
+  </style>
+</head>
+<body>
+  <div class="toolbar">A4 preview • {_HOLE} • {_HOLE} column(s)</div>"""
+
+# The whole document pre-split around its holes, so a rebuild is one join
+_PARTS_STATIC = tuple((_HEAD_HTML + _VARS_HTML + _BODY_OPEN + _HOLE + _TAIL_HTML).split(_HOLE))
+
+# A4 page size (mm) per orientation and the column-guide toggle
+_PAGE_DIMS = {"portrait": ("210", "297"), "landscape": ("297", "210")}
+_RULE_CSS = {True: "column-rule: 1px solid #ddd;", False: "column-rule: none;"}
+
+
+def build_html_doc(segments, orientation, columns, margin_mm, gap_mm, font_px, show_guides):
+    """Assemble the standalone A4 preview document around already-rendered segments."""
+    page_w, page_h = _PAGE_DIMS[orientation]
+    rule_css = _RULE_CSS[show_guides]
+
+    content = "".join(f'<div class="col-item">{seg}</div>' for seg in segments)
+
+    p = _PARTS_STATIC
+    return "".join((
+        p[0], page_w, p[1], page_h, p[2], str(margin_mm), p[3], str(gap_mm), p[4],
+        str(font_px), p[5], str(columns), p[6], orientation, p[7], rule_css, p[8],
+        orientation, p[9], str(columns), p[10], content, p[11],
+    ))
+
+
+# Slider-only reruns reuse the segments rendered for this exact text without
+# re-hashing it through st.cache_data; a str caches its own hash, and the
+# equality check short-circuits on identity while md is unchanged.
+_t0 = time.perf_counter()
+_seg_cache = st.session_state.get("_segments_cache")
+if _seg_cache is not None and _seg_cache[0] == hash(md) and _seg_cache[1] == md:
+    segments = _seg_cache[2]
+else:
+    segments = render_segments(md)
+    st.session_state["_segments_cache"] = (hash(md), md, segments)
+_t_segments = time.perf_counter() - _t0
+
 st.write("### Live Preview (print from here)")
-st_html(html_doc, height=900, scrolling=True)
+# The optional Print button lives in the preview's own toolbar: no extra iframe,
+# and window.print() prints the preview document rather than a button frame.
+timings = md_preview(segments, orientation, columns, margin_mm, gap_mm, font_px, show_guides,
+                     show_print_button=show_print_button, debug=show_perf, key="preview")
 
 # --------------------------
-# Download as standalone HTML
+# Optional: perf panel (Python stages this rerun, browser stages last render)
 # --------------------------
-if st.button("Download as HTML"):
-    b = html_doc.encode("utf-8")
-    href = f"data:text/html;base64,{base64.b64encode(b).decode()}"
-    st.markdown(f"[Download the HTML file]({href})", unsafe_allow_html=True)
+if show_perf:
+    with st.expander("Perf"):
+        rows = [
+            {"stage": "python: segments", "ms": round(_t_segments * 1000, 2)},
+        ]
+        if timings:
+            rows += [{"stage": f"browser: {e['stage']}", "ms": round(e["ms"], 2)} for e in timings["entries"]]
+        st.table(rows)
+
+        info = md_render.render_block.cache_info()
+        lookups = info.hits + info.misses
+        if lookups:
+            st.caption(f"Block render cache: {info.hits}/{lookups} hits ({info.hits / lookups:.0%}), {info.currsize} entries")
+        if timings:
+            seg = timings["segments"]
+            st.caption(
+                f"Last browser render: {seg['reused']} segments reused from the DOM, "
+                f"{seg['stored']} from localStorage, {seg['rendered']} rendered"
+            )
+        else:
+            st.caption("Edit the markdown to capture browser timings.")
 
 # --------------------------
-# Optional: quick print button
+# Download as standalone HTML
 # --------------------------
-if show_print_button:
-    st_html("""
-    <div style='text-align:center; margin:10px 0;'>
-      <button onclick='window.print()' style='padding:8px 12px; border:1px solid #ddd; border-radius:6px; background:#fff; cursor:pointer;'>Print / Save as PDF</button>
-    </div>
-    """, height=60)
\ No newline at end of file
+# Payloads are built only when asked for, then kept until the text or layout
+# changes, so ordinary reruns skip the join, encode and gzip entirely.
+doc_key = (md, orientation, columns, margin_mm, gap_mm, font_px, show_guides)
+download = st.session_state.get("download")
+if download is not None and download[0] != doc_key:
+    download = st.session_state["download"] = None
+if download is None:
+    if st.button("Prepare download"):
+        html_doc = build_html_doc(segments, orientation, columns, margin_mm, gap_mm, font_px, show_guides)
+        # Served as raw bytes over HTTP: no base64 data URL inflation
+        html_bytes = html_doc.encode("utf-8")
+        download = st.session_state["download"] = (doc_key, html_bytes, gzip.compress(html_bytes))
+if download is not None:
+    _, html_bytes, gz_bytes = download
+    col_d1, col_d2 = st.columns([1,1])
+    with col_d1:
+        st.download_button("Download as HTML", data=html_bytes, file_name="notes.html", mime="text/html")
+    with col_d2:
+        st.download_button("Download as HTML (.gz)", data=gz_bytes, file_name="notes.html.gz", mime="application/gzip")
@@ -0,0 +1,21 @@
+# components/md_editor
+# Markdown textarea that reports its value back to Streamlit only after the
+# user pauses typing, so a burst of keystrokes costs at most one rerun.
+
+import os
+
+import streamlit.components.v1 as components
+
+_component = components.declare_component(
+    "md_editor", path=os.path.dirname(os.path.abspath(__file__))
+)
+
+
+def md_editor(value, height=480, debounce_ms=300, key=None):
+    """Show an editor seeded with ``value``.
+
+    Returns None until the user edits, then the last debounced send as
+    ``{"text", "seq", "session"}``; ``seq`` grows on every send, so the caller
+    can tell a new edit from a stale echo even when the text is the same.
+    """
+    return _component(value=value, height=height, debounce_ms=debounce_ms, key=key, default=None)
@@ -0,0 +1,32 @@
+# components/md_preview
+# Sticky A4 preview: the iframe is mounted once and later reruns only push
+# new args into it, so highlight.js/KaTeX stay parsed and warm.
+
+import os
+
+import streamlit.components.v1 as components
+
+_component = components.declare_component(
+    "md_preview", path=os.path.dirname(os.path.abspath(__file__))
+)
+
+
+def md_preview(segments, orientation, columns, margin_mm, gap_mm, font_px, show_guides,
+               show_print_button=True, debug=False, key=None):
+    """Show pre-rendered HTML segments in the persistent A4 preview iframe.
+
+    With ``debug`` on, returns the client-side stage timings of the last render.
+    """
+    return _component(
+        segments=segments,
+        orientation=orientation,
+        columns=columns,
+        margin_mm=margin_mm,
+        gap_mm=gap_mm,
+        font_px=font_px,
+        show_guides=show_guides,
+        show_print_button=show_print_button,
+        debug=debug,
+        key=key,
+        default=None,
+    )
@@ -0,0 +1,67 @@
+# components/md_render.py
+# Server-side Markdown rendering. Kept out of app.py on purpose: Streamlit
+# re-executes the script as a fresh __main__ on every rerun, whereas an
+# imported module stays in sys.modules, so the block cache below persists
+# across reruns and sessions.
+# - markdown-it-py for CommonMark + tables + strikethrough
+# - $...$ / $$...$$ left as .math spans/divs for KaTeX in the browser
+
+import re
+from functools import lru_cache
+
+from markdown_it import MarkdownIt
+from markdown_it.common.utils import escapeHtml
+from mdit_py_plugins.dollarmath import dollarmath_plugin
+
+_MD = (
+    MarkdownIt("commonmark")
+    .enable(["table", "strikethrough"])
+    .use(dollarmath_plugin, allow_labels=False, double_inline=True)
+)
+# Inline $$...$$ would otherwise render as a <div> inside <p>
+_MD.add_render_rule(
+    "math_inline_double",
+    lambda self, tokens, idx, options, env: f'<span class="math block">{escapeHtml(tokens[idx].content)}</span>',
+)
+
+# markdown-it normalizes line endings the same way before its block parse
+_NEWLINES_RE = re.compile(r"\r\n?|\n")
+
+
+def split_segments(md, env=None):
+    """Split markdown into sections, one per top-level heading.
+
+    Boundaries come from markdown-it's own block parse, so fences of any
+    kind, '#' lines that are not headings and headings nested in quotes or
+    lists never split a section. Link reference definitions land in ``env``.
+    """
+    env = {} if env is None else env
+    lines = _NEWLINES_RE.split(md)
+    starts = [tok.map[0] for tok in _MD.parse(md, env) if tok.type == "heading_open" and tok.level == 0]
+    bounds = [0] + [start for start in starts if start > 0] + [len(lines)]
+    return ["\n".join(lines[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+
+def _references(env):
+    """The document's link reference definitions as a hashable cache key."""
+    refs = env.get("references", {})
+    return tuple((label, ref["href"], ref["title"]) for label, ref in refs.items())
+
+
+@lru_cache(maxsize=4096)
+def render_block(text, references=()):
+    """Render one segment to HTML (memoized per process).
+
+    ``references`` are the whole document's link definitions, so a link in
+    this segment resolves even when its definition sits in another one.
+    """
+    env = {"references": {label: {"href": href, "title": title} for label, href, title in references}}
+    return _MD.render(text, env)
+
+
+def render_segments(md):
+    """Render each segment of ``md`` to HTML independently."""
+    env = {}
+    segments = split_segments(md, env)
+    references = _references(env)
+    return [render_block(seg, references) for seg in segments]
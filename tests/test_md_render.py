@@ -0,0 +1,28 @@
+# Rendering segment by segment must match rendering the whole document once.
+
+import pytest
+
+from components.md_render import _MD, render_segments
+
+DOCS = [
+    "~~~python\n# comment\nx=1\n~~~",
+    "````\n```\n# not a heading\n```\n````\n\n# Real",
+    "  ```\n# comment\n  ```\n# After",
+    "text\n#hashtag",
+    "# One\nsee [link][r]\n\n# Two\n[r]: https://example.com 'Title'",
+    "$$\n# inside math\n$$\n\n## Next\n- one\n- two",
+    "intro\n\n> # quoted\n> text\n\nSetext\n======\nbody\r\n# Crlf\r\nline",
+]
+
+
+@pytest.mark.parametrize("md", DOCS)
+def test_segments_join_to_whole_render(md):
+    assert "".join(render_segments(md)) == _MD.render(md)
+
+
+def test_splits_at_top_level_headings():
+    assert len(render_segments("intro\n\n# A\ntext\n\n## B\n```\n# c\n```")) == 3
+
+
+def test_math_labels_stay_out_of_katex_input():
+    assert "mathlabel" not in "".join(render_segments("$$ a=b $$ (eq1)"))